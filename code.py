@@ -1,31 +1,53 @@
 import pandas as pd
+import numpy as np
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import time
 import re
+import sqlite3
 import openpyxl
+import xlsxwriter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 
 # --- Configuration ---
 INPUT_XLSX = 'Sri Lanka Food Composition Table_20240514 (1).xlsx' # Input Excel file name
 OUTPUT_XLSX = 'Sri Lanka Food Composition Table_20240514_with_taxonomy.xlsx' # Output Excel file name
 OTT_API_ENDPOINT = 'https://api.opentreeoflife.org/v3/tnrs/match_names' # Default API for reading OTTs
 BATCH_SIZE = 200 # Send names in batches for the initial query
+MAX_CONCURRENT_REQUESTS = 8 # Upper bound on batches in flight at once, to respect the server
+CACHE_DB = '.ott_cache.sqlite' # Local cache of TNRS results, so reruns only query new names
+CACHE_EXPIRY_SECONDS = 30 * 86400 # Cached results older than this are queried again
+RESULT_COLUMNS = [
+    'Primary Matched Name', 'Synonyms', 'OTT ID', 'Rank',
+    'Match Query', 'Match Level', 'Approximate Match', 'Is Synonym Input'
+] # Columns added to the output for each name
+MATCH_LEVELS = ['Species - Original', 'Species - Cleaned', 'Genus'] # Query levels, highest priority first
+ALLOWED_RANKS = frozenset({'genus', 'family', 'order', 'class', 'phylum', 'kingdom'}) # Ranks a genus query may match at
+NA_STRINGS = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+] # Cell values pd.read_excel reads as missing by default
+AUTHORITY_RE = re.compile(r'\s+([A-Z][a-z]*\.?|Moench|L\.)$') # Trailing author abbreviation, e.g. 'L.' or 'Moench'
 
-# --- Helper Functions ---
-# (Helper functions: clean_scientific_name, extract_genus, query_ott_tnrs, process_tnrs_results)
-def clean_scientific_name(name):
-    """Removes common authorities and trailing characters."""
-    if not isinstance(name, str):
-        return None
-    cleaned = re.sub(r'\s+([A-Z][a-z]*\.?|Moench|L\.)$', '', name.strip())
-    return cleaned.strip()
-
-def extract_genus(name):
-    """Extracts the first word, assumed to be the genus."""
-    if not isinstance(name, str) or ' ' not in name:
-        return None
-    return name.split(' ', 1)[0]
+# One pooled keep-alive session for all TNRS calls, so batches reuse connections instead of
+# doing a new TCP/TLS handshake each. match_names only reads, so POSTs are safe to retry.
+# Rate limiting is left to the server: there is no fixed pause between batches, and
+# throttled requests are retried after the delay the server asks for.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=MAX_CONCURRENT_REQUESTS,
+    pool_maxsize=MAX_CONCURRENT_REQUESTS,
+    max_retries=Retry(
+        total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504], allowed_methods=['POST'],
+        respect_retry_after_header=True # On 429/503, wait as long as the server's Retry-After asks
+    )
+))
 
+# --- Helper Functions ---
+# (Helper functions: query_ott_tnrs, process_tnrs_results, resolve_match, add_unmatched_items, TNRS cache, query_ott_batches, write_xlsx_streaming, dedupe_header)
 def query_ott_tnrs(names_list, description=""):
     """Queries OTT TNRS API for a list of names."""
     if not names_list:
@@ -37,68 +59,205 @@ def query_ott_tnrs(names_list, description=""):
     }
     print(f"Querying OTT for {len(names_list)} names ({description})...")
     try:
-        response = requests.post(OTT_API_ENDPOINT, json=payload, headers={'Content-Type': 'application/json'})
+        response = SESSION.post(OTT_API_ENDPOINT, json=payload, headers={'Content-Type': 'application/json'}, timeout=60)
         response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content) # Faster than the stdlib parser behind response.json()
     except requests.exceptions.RequestException as e:
         print(f"API request failed ({description}): {e}")
         if hasattr(e, 'response') and e.response is not None:
             print(f"Response content: {e.response.text}")
         return None
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Failed to decode JSON response ({description}): {response.text}")
         return None
 
-def process_tnrs_results(api_response, results_dict, match_level, query_map=None):
-    """Updates the results dictionary with matches from an API response."""
+def process_tnrs_results(api_response, level_items, query_targets):
+    """Files each result item under every (name, match level) pair that sent its query."""
     if not api_response or 'results' not in api_response:
-        print(f"Warning: Invalid API response for {match_level}")
+        print("Warning: Invalid API response for combined query")
         return
 
     for item in api_response['results']:
-        original_query_name = item['name']
-        target_name = query_map.get(original_query_name, original_query_name) if query_map else original_query_name
-
-        if target_name not in results_dict or results_dict[target_name].get('OTT ID') is None:
-            if item['matches']:
-                match = item['matches'][0] # Take the first match
-                taxon = match['taxon']
-                results_dict[target_name] = {
-                    'Primary Matched Name': taxon.get('unique_name', None),
-                    'Synonyms': "; ".join(taxon.get('synonyms', [])),
-                    'OTT ID': taxon.get('ott_id', None),
-                    'Rank': taxon.get('rank', None),
-                    'Match Query': original_query_name,
-                    'Match Level': match_level,
-                    'Approximate Match': match.get('is_approximate_match', False),
-                    'Is Synonym Input': match.get('is_synonym', False)
-                }
-            elif match_level == 'Species - Original' and target_name not in results_dict:
-                 results_dict[target_name] = {
-                    'Primary Matched Name': None, 'Synonyms': None, 'OTT ID': None,
-                    'Rank': None, 'Match Query': original_query_name,
-                    'Match Level': 'No Match Initial', 'Approximate Match': False, 'Is Synonym Input': False
-                 }
+        for target_name, match_level in query_targets.get(item['name'], ()):
+            level_items.setdefault(target_name, {})[match_level] = item
+
+def resolve_match(name, items_by_level):
+    """Builds the results record for a name from its highest-priority usable match.
+
+    Levels are tried in MATCH_LEVELS order; a genus match only counts at one of ALLOWED_RANKS.
+    """
+    for match_level in MATCH_LEVELS:
+        item = items_by_level.get(match_level)
+        if not item or not item['matches']:
+            continue
+        match = item['matches'][0] # Take the first match
+        taxon = match['taxon']
+        ott_id = taxon.get('ott_id')
+        if ott_id is None:
+            continue
+        rank = taxon.get('rank')
+        if match_level == 'Genus' and (rank or '').lower() not in ALLOWED_RANKS:
+            continue
+        return {
+            'Primary Matched Name': taxon.get('unique_name'),
+            'Synonyms': taxon.get('synonyms') or [], # Joined into one string at output time
+            'OTT ID': ott_id,
+            'Rank': rank,
+            'Match Query': item['name'],
+            'Match Level': match_level,
+            'Approximate Match': match.get('is_approximate_match', False),
+            'Is Synonym Input': match.get('is_synonym', False)
+        }
+
+    if 'Species - Original' not in items_by_level:
+        match_level = 'Processing Error' # The batch holding the original name failed
+    elif 'Genus' in items_by_level and not items_by_level['Genus']['matches']:
+        match_level = 'No Match Final - Genus Failed' # More specific failure
+    else:
+        match_level = 'No Match Final'
+    return {
+        'Primary Matched Name': None, 'Synonyms': None, 'OTT ID': None, 'Rank': None,
+        'Match Query': name, 'Match Level': match_level, 'Approximate Match': False, 'Is Synonym Input': False
+    }
+
+def open_tnrs_cache(path=CACHE_DB):
+    """Opens (creating if needed) the SQLite cache of TNRS results."""
+    cache = sqlite3.connect(path)
+    cache.execute(
+        'CREATE TABLE IF NOT EXISTS tnrs_results ('
+        'endpoint TEXT, name TEXT, result TEXT, fetched_at REAL, PRIMARY KEY (endpoint, name))'
+    )
+    return cache
+
+def get_cached_results(cache, names_list):
+    """Returns {name: result item} for names with an unexpired cache entry."""
+    cached = {}
+    min_fetched_at = time.time() - CACHE_EXPIRY_SECONDS
+    for i in range(0, len(names_list), BATCH_SIZE): # Stay well under SQLite's bound-parameter limit
+        batch = names_list[i:i+BATCH_SIZE]
+        rows = cache.execute(
+            f"SELECT name, result FROM tnrs_results WHERE endpoint = ? AND fetched_at >= ? "
+            f"AND name IN ({', '.join('?' * len(batch))})",
+            [OTT_API_ENDPOINT, min_fetched_at, *batch]
+        )
+        for name, result in rows:
+            cached[name] = orjson.loads(result)
+    return cached
+
+def add_unmatched_items(api_response):
+    """Adds an empty-match result item for each name TNRS lists only in 'unmatched_names'.
+
+    Fresh and cached responses then look the same: every queried name has a result item.
+    """
+    if not api_response or 'results' not in api_response:
+        return api_response
+    listed = {item['name'] for item in api_response['results']}
+    for name in api_response.get('unmatched_names', []):
+        if name not in listed:
+            listed.add(name)
+            api_response['results'].append({'name': name, 'matches': []})
+    return api_response
+
+def store_cached_results(cache, api_response):
+    """Saves each name's result item from an API response, including names with no match."""
+    api_response = add_unmatched_items(api_response)
+    if not api_response or 'results' not in api_response:
+        return
+    fetched_at = time.time()
+    cache.executemany(
+        'INSERT OR REPLACE INTO tnrs_results (endpoint, name, result, fetched_at) VALUES (?, ?, ?, ?)',
+        [(OTT_API_ENDPOINT, item['name'], orjson.dumps(item), fetched_at) for item in api_response['results']]
+    )
+    cache.commit()
+
+def query_ott_batches(names_list, description="", cache=None):
+    """Queries OTT TNRS in BATCH_SIZE chunks, running up to MAX_CONCURRENT_REQUESTS at once.
+
+    Each distinct name is sent at most once. Names with a cached result are not sent; their
+    items are returned as one extra response ahead of the fetched ones. Otherwise returns the
+    API responses in batch order (None for failed batches).
+    """
+    names_list = list(dict.fromkeys(names_list)) # Drop repeated names, keeping first-seen order
+    cached = get_cached_results(cache, names_list) if cache is not None else {}
+    responses = []
+    if cached:
+        print(f"Using {len(cached)} cached OTT results ({description}).")
+        responses.append({'results': list(cached.values())})
+    misses = [name for name in names_list if name not in cached]
+    batches = [misses[i:i+BATCH_SIZE] for i in range(0, len(misses), BATCH_SIZE)]
+    if not batches:
+        return responses
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(batches))) as executor:
+        futures = [
+            executor.submit(query_ott_tnrs, batch, f"{description} Batch {n + 1}")
+            for n, batch in enumerate(batches)
+        ]
+        fetched = [add_unmatched_items(future.result()) for future in futures]
+    if cache is not None:
+        for api_response in fetched:
+            store_cached_results(cache, api_response)
+    return responses + fetched
+
+def write_xlsx_streaming(df, path, sheet_name):
+    """Writes a DataFrame with xlsxwriter's constant_memory mode, flushing each row to disk.
+
+    Rows are written in order, as constant_memory cannot go back to an earlier row
+    (which is why df.to_excel, which writes column by column, cannot use it).
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(column) for column in df.columns])
+        for row_num, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_num, 0, [None if pd.isna(value) else value for value in row]) # Missing values are left blank
+    finally:
+        workbook.close()
+
+def dedupe_header(header):
+    """Renames repeated column names to 'name.1', 'name.2', ... as pd.read_excel does."""
+    counts = {}
+    deduped = []
+    for column in header:
+        count = counts.get(column, 0)
+        while count > 0: # Keep counting if the suffixed name is itself taken
+            counts[column] = count + 1
+            column = f"{column}.{count}"
+            count = counts.get(column, 0)
+        counts[column] = count + 1
+        deduped.append(column)
+    return deduped
 
 # --- Load Data ---
 try:
-    # Assumes data is in the first sheet (sheet_name=0)
-    # Assumes header is row 0 (header=0)
-    # Assumes the units row (row 1) needs skipping (skiprows=[1])
-    df = pd.read_excel(INPUT_XLSX, header=0, skiprows=[1], sheet_name=0)
-    # <<< END CHANGED >>>
-
+    # Stream the first sheet in read-only mode instead of parsing it through pd.read_excel.
+    # Assumes data is in the first sheet, the header is row 0 and row 1 is a units row to skip.
+    wb = openpyxl.load_workbook(INPUT_XLSX, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [c if c is not None else f"Unnamed: {i}" for i, c in enumerate(next(rows))]
+        if 'Scientific Name' not in header:
+            # Add check for leading/trailing spaces in column names
+            header = [c.strip() if isinstance(c, str) else c for c in header]
+            if 'Scientific Name' not in header:
+                raise ValueError("Column 'Scientific Name' not found.")
+        header = dedupe_header(header)
+        next(rows, None) # Skip the units row
+        records = list(rows)
+        # Read-only sheets also yield formatted rows with no values; drop the trailing ones as pd.read_excel does
+        while records and all(value is None for value in records[-1]):
+            records.pop()
+        # Empty cells come back as None, and NA placeholder strings stay text; use NaN for both as pd.read_excel would
+        df = pd.DataFrame.from_records(records, columns=header).fillna(np.nan)
+        df = df.mask(df.isin(NA_STRINGS)).infer_objects()
+    finally:
+        wb.close()
     print(f"Loaded DataFrame from '{INPUT_XLSX}' with shape: {df.shape}")
-    if 'Scientific Name' not in df.columns:
-        # Add check for leading/trailing spaces in column names
-        df.columns = df.columns.str.strip()
-        if 'Scientific Name' not in df.columns:
-             raise ValueError("Column 'Scientific Name' not found.")
-
-    # Handle potential NaN values explicitly if necessary and convert to string
-    df['Scientific Name'] = df['Scientific Name'].astype(str)
-    unique_names = df['Scientific Name'].replace('nan', '').dropna().unique().tolist()
-    unique_names = [name for name in unique_names if name and name.lower() != 'nan'] # Remove empty strings and 'nan' strings
+
+    # Normalize and deduplicate names in one vectorized pass; empty and 'nan' names are dropped
+    names = df['Scientific Name'].astype('string').str.strip()
+    df['Scientific Name'] = names.astype(object)
+    valid = names.notna() & (names != '') & (names.str.lower() != 'nan')
+    unique_names = pd.unique(names[valid].to_numpy(dtype=object)).tolist() # Plain list, as batches are sent as JSON
     print(f"Found {len(unique_names)} unique non-empty scientific names.")
 
 except FileNotFoundError:
@@ -112,135 +271,91 @@ except Exception as e:
 
 
 # --- Main Processing Logic ---
-all_results = {}
+# One column per result field, indexed by name, rather than one small dict per name
+all_results = pd.DataFrame(columns=RESULT_COLUMNS, index=pd.Index([], name='Scientific Name'))
 
 if unique_names:
-    # --- Step 1: Initial Batch Query with Original Names ---
-    print("\n--- Step 1: Querying Original Scientific Names ---")
-    for i in range(0, len(unique_names), BATCH_SIZE):
-        batch = unique_names[i:i+BATCH_SIZE]
-        batch_result_data = query_ott_tnrs(batch, description=f"Original Batch {i//BATCH_SIZE + 1}")
-        process_tnrs_results(batch_result_data, all_results, 'Species - Original')
-        time.sleep(1) # Pause between batches
-
-    failed_names = [name for name in unique_names if name not in all_results or all_results[name].get('OTT ID') is None]
-    print(f"\n--- Step 1 Complete: {len(unique_names) - len(failed_names)} initial matches, {len(failed_names)} remaining.")
-
-    # --- Step 2: Query Cleaned Names for Failures ---
-    if failed_names:
-        print("\n--- Step 2: Querying Cleaned Scientific Names for Failures ---")
-        cleaned_names_map = {}
-        names_to_query_cleaned = []
-        for name in failed_names:
-            cleaned = clean_scientific_name(name)
+    # Opened only when there are names to look up; closed even if a step raises
+    with closing(open_tnrs_cache()) as tnrs_cache:
+        # --- Step 1: Prepare Original, Cleaned and Genus Queries for Every Name ---
+        print("\n--- Step 1: Preparing Original, Cleaned and Genus Queries ---")
+        names_series = pd.Series(unique_names, dtype=object)
+        # Strip trailing authorities from all names at once
+        cleaned_series = names_series.str.replace(AUTHORITY_RE, '', regex=True).str.strip()
+        # The genus is the first word; single-word names have none
+        genus_series = names_series.str.split(' ', n=1).str[0].where(names_series.str.contains(' ', regex=False), None)
+        query_targets = {} # Query string -> [(name, match level), ...]; keys are the deduplicated queries
+        for name, cleaned, genus in zip(unique_names, cleaned_series, genus_series):
+            query_targets.setdefault(name, []).append((name, 'Species - Original'))
             if cleaned and cleaned != name:
-                cleaned_names_map[cleaned] = name
-                names_to_query_cleaned.append(cleaned)
-        if names_to_query_cleaned:
-            cleaned_result_data = query_ott_tnrs(list(set(names_to_query_cleaned)), description="Cleaned Names") # Use set to avoid duplicate queries
-            process_tnrs_results(cleaned_result_data, all_results, 'Species - Cleaned', query_map=cleaned_names_map)
-            time.sleep(1)
-        else:
-            print("No names needed cleaning or cleaning didn't change them.")
-        failed_names = [name for name in failed_names if all_results[name].get('OTT ID') is None]
-        print(f"--- Step 2 Complete: {len(failed_names)} remaining.")
-
-    # --- Step 3: Query Genus for Remaining Failures ---
-    if failed_names:
-        print("\n--- Step 3: Querying Genus for Remaining Failures ---")
-        genus_map = {}
-        genera_to_query = []
-        for name in failed_names:
-            genus = extract_genus(name)
+                query_targets.setdefault(cleaned, []).append((name, 'Species - Cleaned'))
             if genus:
-                if genus not in genera_to_query:
-                     genera_to_query.append(genus)
-                if genus not in genus_map:
-                    genus_map[genus] = []
-                genus_map[genus].append(name)
-        if genera_to_query:
-            genus_result_data = query_ott_tnrs(genera_to_query, description="Genera")
-            if genus_result_data and 'results' in genus_result_data:
-                 for item in genus_result_data['results']:
-                    genus_query_name = item['name']
-                    if genus_query_name in genus_map:
-                        original_names_for_genus = genus_map[genus_query_name]
-                        for target_name in original_names_for_genus:
-                            if all_results[target_name].get('OTT ID') is None:
-                                if item['matches']:
-                                    match = item['matches'][0]
-                                    taxon = match['taxon']
-                                    if taxon.get('rank', '').lower() in ['genus', 'family', 'order', 'class', 'phylum', 'kingdom']:
-                                         all_results[target_name] = {
-                                            'Primary Matched Name': taxon.get('unique_name', None), 'Synonyms': "; ".join(taxon.get('synonyms', [])),
-                                            'OTT ID': taxon.get('ott_id', None), 'Rank': taxon.get('rank', None),
-                                            'Match Query': genus_query_name, 'Match Level': 'Genus',
-                                            'Approximate Match': match.get('is_approximate_match', False), 'Is Synonym Input': match.get('is_synonym', False)
-                                        }
-                                else:
-                                     all_results[target_name]['Match Level'] = 'No Match Final - Genus Failed' # More specific failure
-            time.sleep(1)
-        else:
-            print("No valid genera extracted from remaining failures.")
+                query_targets.setdefault(genus, []).append((name, 'Genus'))
+        print(f"--- Step 1 Complete: {len(query_targets)} distinct queries for {len(unique_names)} names.")
 
-        failed_names = [name for name in failed_names if all_results[name].get('OTT ID') is None]
-        for name in failed_names:
-             if all_results[name]['Match Level'] not in ['Genus', 'No Match Final - Genus Failed']:
-                 all_results[name]['Match Level'] = 'No Match Final'
-        print(f"--- Step 3 Complete: {len(failed_names)} definitely unmatched.")
+        # --- Step 2: Query All Levels in One Round of Batches ---
+        print("\n--- Step 2: Querying Original, Cleaned and Genus Names ---")
+        level_items = {} # Name -> {match level: TNRS result item}
+        for result_data in query_ott_batches(list(query_targets), description="Combined", cache=tnrs_cache):
+            process_tnrs_results(result_data, level_items, query_targets)
+
+        # If no name got an original-level item (e.g. every batch failed), leave all_results empty
+        # so nothing is written, rather than overwriting a previous output with 'Processing Error' rows
+        if any('Species - Original' in items for items in level_items.values()):
+            # --- Step 3: Resolve Each Name to Its Highest-Priority Match ---
+            print("\n--- Step 3: Resolving Matches by Priority ---")
+            result_columns = {column: [] for column in RESULT_COLUMNS}
+            for name in unique_names:
+                record = resolve_match(name, level_items.get(name, {}))
+                for column in RESULT_COLUMNS:
+                    result_columns[column].append(record[column])
+            all_results = pd.DataFrame(result_columns, index=pd.Index(unique_names, name='Scientific Name'))
+            num_matched = int(all_results['OTT ID'].notna().sum())
+            print(f"--- Step 3 Complete: {num_matched} matched, {len(unique_names) - num_matched} definitely unmatched.")
 
 # --- Create Results DataFrame and Merge ---
-if not all_results:
+if all_results.empty:
      print("No results obtained from API.")
 elif df.empty:
     print("Original DataFrame is empty, cannot merge.")
+elif 'Scientific Name' not in df.columns:
+     print("Error: 'Scientific Name' column missing in original DataFrame for merge.")
 else:
-    for name in unique_names:
-        if name not in all_results:
-             all_results[name] = {
-                'Primary Matched Name': None, 'Synonyms': None, 'OTT ID': None, 'Rank': None,
-                'Match Query': name, 'Match Level': 'Processing Error', 'Approximate Match': False, 'Is Synonym Input': False
-             }
-        elif all_results[name].get('OTT ID') is None and all_results[name]['Match Level'] == 'No Match Initial':
-             all_results[name]['Match Level'] = 'No Match Final'
-
-    results_df = pd.DataFrame.from_dict(all_results, orient='index')
-    results_df.index.name = 'Scientific Name_original_lookup'
-    results_df.reset_index(inplace=True)
-
-    if 'Scientific Name_original_lookup' not in results_df.columns:
-         print("Error: Lookup column missing in results DataFrame.")
-    elif 'Scientific Name' not in df.columns:
-         print("Error: 'Scientific Name' column missing in original DataFrame for merge.")
-    else:
-        print("\nMerging results back into DataFrame...")
-        df_merged = pd.merge(
-            df,
-            results_df,
-            left_on='Scientific Name',
-            right_on='Scientific Name_original_lookup',
-            how='left'
-        )
-        df_merged.drop(columns=['Scientific Name_original_lookup'], inplace=True)
-
-        # --- Save Output ---
-        try:
-            # index=False prevents writing the DataFrame index as a column
-            # sheet_name specifies the name of the sheet in the output file
-            df_merged.to_excel(OUTPUT_XLSX, index=False, sheet_name='Processed Data')
-            # <<< END CHANGED >>>
-
-            print(f"\nSuccessfully saved augmented data to {OUTPUT_XLSX}")
-            print(f"Final DataFrame shape: {df_merged.shape}")
-            if 'Match Level' in df_merged.columns:
-                print("\nMatch Level Summary:")
-                print(df_merged['Match Level'].value_counts(dropna=False))
-            else:
-                 print("Match Level column not found in merged df.")
-
-        except Exception as e:
-            # Provide more specific error for permission issues
-            if isinstance(e, PermissionError):
-                 print(f"Error saving output Excel file: Permission denied. Is '{OUTPUT_XLSX}' open or write-protected?")
-            else:
-                 print(f"Error saving output Excel file: {e}")
\ No newline at end of file
+    # Results are indexed by the exact 'Scientific Name' value. Storing that column as a
+    # categorical lets each result column be aligned once to the distinct names and then
+    # gathered into the existing frame by category code, without merging a copy of it.
+    print("\nMerging results back into DataFrame...")
+    df['Scientific Name'] = df['Scientific Name'].astype('category')
+    codes = df['Scientific Name'].cat.codes.to_numpy()
+    results_by_code = all_results.reindex(df['Scientific Name'].cat.categories)
+    for column in RESULT_COLUMNS:
+        column_values = results_by_code[column]
+        if column == 'Synonyms':
+            # Records keep the raw synonym lists; join them in one vectorized pass here
+            column_values = column_values.str.join('; ')
+        # Rows with no name have code -1, which allow_fill turns into a missing value
+        df[column] = pd.api.extensions.take(column_values.to_numpy(), codes, allow_fill=True)
+
+    # --- Save Output ---
+    try:
+        # Streams rows to disk rather than building the whole workbook in memory
+        # sheet_name specifies the name of the sheet in the output file
+        write_xlsx_streaming(df, OUTPUT_XLSX, sheet_name='Processed Data')
+
+        print(f"\nSuccessfully saved augmented data to {OUTPUT_XLSX}")
+        print(f"Final DataFrame shape: {df.shape}")
+        if 'Match Level' in df.columns:
+            print("\nMatch Level Summary:")
+            print(df['Match Level'].value_counts(dropna=False))
+        else:
+             print("Match Level column not found in merged df.")
+
+    except Exception as e:
+        # Provide more specific error for permission issues
+        # xlsxwriter wraps any IOError from close() in FileCreateError, so check what it wraps
+        if isinstance(e, PermissionError) or (
+            isinstance(e, xlsxwriter.exceptions.FileCreateError) and e.args and isinstance(e.args[0], PermissionError)
+        ):
+             print(f"Error saving output Excel file: Permission denied. Is '{OUTPUT_XLSX}' open or write-protected?")
+        else:
+             print(f"Error saving output Excel file: {e}")
\ No newline at end of file